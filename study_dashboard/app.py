@@ -1,40 +1,58 @@
 import streamlit as st
 try:
-    import pandas as pd
-    import plotly.express as px
-    import plotly.graph_objects as go
-    from datetime import datetime, timedelta, time
-    import json
-    import time as time_module
-    import numpy as np
+    from datetime import datetime, time
+    import os
+    from functools import lru_cache
     from data_manager import StudyDataManager
     from study_agent import StudyAgent
-    import hashlib
     from github_state_manager import github_state_manager
+    from github_manager import dumps_json
 except ImportError as e:
     st.error(f"导入错误: {e}")
     st.info("请确保 requirements.txt 包含所有必要的依赖包")
     st.stop()
-# 在导入部分修改
-try:
-    from github_manager import GitHubDataManager
-    data_manager = GitHubDataManager()
-except ImportError:
-    from data_manager import StudyDataManager
-    data_manager = StudyDataManager()
+# 数据管理器跨 rerun 复用，并与状态管理器共用同一个 GitHub 连接
+@st.cache_resource
+def get_data_manager():
+    try:
+        from github_manager import GitHubDataManager
+        if isinstance(github_state_manager.github_manager, GitHubDataManager):
+            return github_state_manager.github_manager
+        return GitHubDataManager()
+    except ImportError:
+        return StudyDataManager()
+
+data_manager = get_data_manager()
 
 MAX_TASK_COUNT = 12
+SUBJECT_OPTIONS = ["math", "physics", "econ", "cs", "other"]
+ENERGY_OPTIONS = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+
+# 新增任务的默认字段（时间和 task_id 按位置另行填写）
+TASK_DEFAULT_TEMPLATE = {
+    'task_name': '',
+    'subject': 'math',
+    'difficulty': 3,
+    'planned_duration': 60,
+    'planned_focus_duration': 48
+}
+
+# 兼容旧版本 Streamlit：不支持 fragment 时退化为普通函数
+fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', lambda func: func)
+
+# 每次脚本运行只读取一次当前时间，整个 rerun 视为同一时刻
+TODAY = datetime.now().date()
 
 def handle_date_change(selected_date):
     """处理日期变更 - 更新所有控件状态"""
-    current_date = st.session_state.get('current_date', datetime.now().date())
+    current_date = st.session_state.get('current_date', TODAY)
     
     # 如果日期没有变化，直接返回
     if selected_date == current_date:
         return
     
     # 保存当前日期的状态（如果有变化）
-    if github_state_manager._get_state_hash() != github_state_manager.last_state_hash:
+    if github_state_manager._get_state_hash() != st.session_state.get('last_state_hash'):
         github_state_manager.auto_save_state(force=True)
     
     # 更新当前日期
@@ -43,94 +61,102 @@ def handle_date_change(selected_date):
     # 调用状态管理器的日期变更处理
     github_state_manager._handle_plan_date_change(selected_date.isoformat())
     
-    # 强制更新所有表单组件状态
-    update_all_form_components()
+    # 清除表单指纹，重新运行的开头统一刷新表单组件状态
+    st.session_state._form_fingerprint = None
     
     # 强制重新运行以应用新状态
     st.rerun()
 
+def set_state_if_changed(key, value):
+    """只在值不同时写入 session_state，避免无变化的重复写入"""
+    if st.session_state.get(key) != value:
+        st.session_state[key] = value
+
 def update_all_form_components():
     """更新所有表单组件的状态 - 确保切换日期后表单显示正确数据"""
     planned_tasks = st.session_state.get('planned_tasks', [])
+    actual_execution = st.session_state.get('actual_execution', [])
     
     # 更新所有任务相关的表单组件状态
     for i, task in enumerate(planned_tasks):
         # 任务名称
-        task_name_key = f"task_name_{i}"
-        st.session_state[task_name_key] = task.get('task_name', '')
+        set_state_if_changed(f"task_name_{i}", task.get('task_name', ''))
         
         # 学科
-        subject_key = f"subject_{i}"
-        st.session_state[subject_key] = task.get('subject', 'math')
+        set_state_if_changed(f"subject_{i}", task.get('subject', 'math'))
         
         # 难度
-        difficulty_key = f"difficulty_{i}"
-        st.session_state[difficulty_key] = task.get('difficulty', 3)
+        set_state_if_changed(f"difficulty_{i}", task.get('difficulty', 3))
         
         # 开始时间
-        start_key = f"start_{i}"
         start_time = task.get('planned_start_time', time(9+i, 0))
         if isinstance(start_time, str):
             start_time = parse_time(start_time)
-        st.session_state[start_key] = start_time
+        set_state_if_changed(f"start_{i}", start_time)
         
         # 结束时间
-        end_key = f"end_{i}"
         end_time = task.get('planned_end_time', time(10+i, 0))
         if isinstance(end_time, str):
             end_time = parse_time(end_time)
-        st.session_state[end_key] = end_time
+        set_state_if_changed(f"end_{i}", end_time)
+        
+        # 该任务的实际执行记录，每个任务只取一次
+        saved_actual = actual_execution[i] if i < len(actual_execution) else {}
         
         # 实际开始时间
-        actual_start_key = f"actual_start_{i}"
-        actual_execution = st.session_state.get('actual_execution', [])
-        actual_start_time = actual_execution[i].get('actual_start_time', start_time) if i < len(actual_execution) else start_time
+        actual_start_time = saved_actual.get('actual_start_time', start_time)
         if isinstance(actual_start_time, str):
             actual_start_time = parse_time(actual_start_time)
-        st.session_state[actual_start_key] = actual_start_time
+        set_state_if_changed(f"actual_start_{i}", actual_start_time)
         
         # 实际结束时间
-        actual_end_key = f"actual_end_{i}"
-        actual_end_time = actual_execution[i].get('actual_end_time', end_time) if i < len(actual_execution) else end_time
+        actual_end_time = saved_actual.get('actual_end_time', end_time)
         if isinstance(actual_end_time, str):
             actual_end_time = parse_time(actual_end_time)
-        st.session_state[actual_end_key] = actual_end_time
+        set_state_if_changed(f"actual_end_{i}", actual_end_time)
         
         # 精力水平
-        energy_key = f"energy_input_{i}"
-        actual_energy = actual_execution[i].get('post_energy', 7) if i < len(actual_execution) else 7
-        st.session_state[energy_key] = actual_energy
+        set_state_if_changed(f"energy_input_{i}", saved_actual.get('post_energy', 7))
+
+def sync_widget_to_state(widget_key, state_key):
+    """控件变化时同步到对应的 session_state 键（on_change 回调）"""
+    st.session_state[state_key] = st.session_state[widget_key]
+
+def update_reflection():
+    """反思内容变化时同步并智能保存（on_change 回调，不在每次 rerun 比较）"""
+    reflection = st.session_state.get('reflection_input', "")
+    if reflection.strip():
+        st.session_state.current_reflection = reflection
+        github_state_manager.auto_save_state()
 
 def process_all_task_data(task_count, current_date):
     """处理所有任务数据并更新到 session_state"""
     planned_tasks = []
-    valid_task_count = 0
+    session_get = st.session_state.get
     
     for i in range(task_count):
-        task_name = st.session_state.get(f"task_name_{i}", "").strip()
-        subject = st.session_state.get(f"subject_{i}", "math")
-        difficulty = st.session_state.get(f"difficulty_{i}", 3)
-        start_time = st.session_state.get(f"start_{i}", time(9+i, 0))
-        end_time = st.session_state.get(f"end_{i}", time(10+i, 0))
+        task_name = session_get(f"task_name_{i}", "").strip()
+        if not task_name:  # 只保存有任务名称的任务，空行不再读取其余字段
+            continue
+        
+        subject = session_get(f"subject_{i}", "math")
+        difficulty = session_get(f"difficulty_{i}", 3)
+        start_time = session_get(f"start_{i}") or time(9+i, 0)
+        end_time = session_get(f"end_{i}") or time(10+i, 0)
         
         # 计算时长
-        start_dt = datetime.combine(current_date, start_time)
-        end_dt = datetime.combine(current_date, end_time)
-        calculated_duration = calculate_duration(start_dt, end_dt)
+        calculated_duration = minutes_between(start_time, end_time)
         
-        if task_name:  # 只保存有任务名称的任务
-            task_data = {
-                "task_id": valid_task_count + 1,
-                "task_name": task_name,
-                "subject": subject,
-                "planned_duration": calculated_duration,
-                "planned_focus_duration": int(calculated_duration * 0.8),
-                "difficulty": difficulty,
-                "planned_start_time": start_time,
-                "planned_end_time": end_time
-            }
-            planned_tasks.append(task_data)
-            valid_task_count += 1
+        planned_tasks.append({
+            "task_id": len(planned_tasks) + 1,
+            "task_name": task_name,
+            "subject": subject,
+            "planned_duration": calculated_duration,
+            "planned_focus_duration": int(calculated_duration * 0.8),
+            "difficulty": difficulty,
+            "planned_start_time": start_time,
+            "planned_end_time": end_time
+        })
     
     return planned_tasks
 
@@ -144,9 +170,7 @@ def update_task_data_in_realtime(i, current_date):
     
     if task_name:
         # 计算时长
-        start_dt = datetime.combine(current_date, start_time)
-        end_dt = datetime.combine(current_date, end_time)
-        calculated_duration = calculate_duration(start_dt, end_dt)
+        calculated_duration = minutes_between(start_time, end_time)
         
         task_data = {
             "task_id": i + 1,
@@ -161,8 +185,8 @@ def update_task_data_in_realtime(i, current_date):
         
         # 更新或添加任务数据
         planned_tasks = st.session_state.get('planned_tasks', [])
-        while len(planned_tasks) <= i:
-            planned_tasks.append({})
+        if len(planned_tasks) <= i:
+            planned_tasks.extend({} for _ in range(i + 1 - len(planned_tasks)))
         planned_tasks[i] = task_data
         st.session_state.planned_tasks = planned_tasks
         
@@ -180,9 +204,7 @@ def update_actual_execution_data(i, task, current_date):
         return False  # 时间无效，不保存
     
     # 计算时长
-    start_dt = datetime.combine(current_date, actual_start_time)
-    end_dt = datetime.combine(current_date, actual_end_time)
-    actual_duration = calculate_duration(start_dt, end_dt)
+    actual_duration = minutes_between(actual_start_time, actual_end_time)
     
     actual_data = {
         "task_id": task['task_id'],
@@ -197,6 +219,8 @@ def update_actual_execution_data(i, task, current_date):
     # 更新实际执行数据
     actual_execution = st.session_state.get('actual_execution', [])
     if i < len(actual_execution):
+        if actual_execution[i] == actual_data:
+            return True  # 数据未变化，无需写入和保存
         actual_execution[i] = actual_data
     else:
         actual_execution.append(actual_data)
@@ -206,19 +230,37 @@ def update_actual_execution_data(i, task, current_date):
     github_state_manager.auto_save_state()
     return True
 
+# 解析失败时使用的默认时间
+DEFAULT_TIME = time(9, 0)
+
+@lru_cache(maxsize=256)
+def parse_time_str(time_str):
+    """解析 'HH:MM' 字符串 - 取值范围有限，结果缓存"""
+    try:
+        return datetime.strptime(time_str, '%H:%M').time()
+    except ValueError:
+        return DEFAULT_TIME
+
 def parse_time(time_value):
     """通用时间解析函数"""
-    try:
-        # 如果已经是 time 对象，直接返回
-        if hasattr(time_value, 'hour') and hasattr(time_value, 'minute'):
-            return time_value
-        # 如果是字符串，尝试解析
-        elif isinstance(time_value, str):
-            return datetime.strptime(time_value, '%H:%M').time()
-        else:
-            return datetime.strptime("09:00", '%H:%M').time()
-    except (ValueError, TypeError):
-        return datetime.strptime("09:00", '%H:%M').time()
+    # 如果已经是 time 对象，直接返回
+    if hasattr(time_value, 'hour') and hasattr(time_value, 'minute'):
+        return time_value
+    # 如果是字符串，尝试解析
+    if isinstance(time_value, str):
+        return parse_time_str(time_value)
+    return DEFAULT_TIME
+
+@lru_cache(maxsize=256)
+def normalize_hhmm_str(time_str):
+    """校验并规范化 'HH:MM' 字符串 - 非法值回退到默认时间，结果缓存"""
+    return parse_time_str(time_str).strftime('%H:%M')
+
+def to_hhmm(time_value):
+    """转为 'HH:MM' 字符串 - 字符串经缓存的解析校验，同一字符串只解析一次"""
+    if isinstance(time_value, str):
+        return normalize_hhmm_str(time_value)
+    return parse_time(time_value).strftime('%H:%M')
 
 def check_time_conflicts(planned_tasks, date):
     """检查任务时间是否重叠"""
@@ -232,43 +274,99 @@ def check_time_conflicts(planned_tasks, date):
                 start_time = parse_time(task['planned_start_time'])
                 end_time = parse_time(task['planned_end_time'])
                 
-                start_dt = datetime.combine(date, start_time)
-                end_dt = datetime.combine(date, end_time)
+                # 换算为当天分钟数，用整数比较代替 datetime 对象
+                start = start_time.hour * 60 + start_time.minute
+                end = end_time.hour * 60 + end_time.minute
                 
                 # 处理跨天情况（比如23:00到01:00）
-                if end_dt <= start_dt:
-                    end_dt += timedelta(days=1)
+                if end <= start:
+                    end += 24 * 60
                 
-                time_ranges.append({
-                    'task_name': task['task_name'],
-                    'start': start_dt,
-                    'end': end_dt
-                })
+                time_ranges.append((start, end, task['task_name']))
                 
             except Exception as e:
                 # 如果时间解析失败，跳过这个任务
                 continue
     
-    # 检查时间重叠
-    for i in range(len(time_ranges)):
-        for j in range(i + 1, len(time_ranges)):
-            range1 = time_ranges[i]
-            range2 = time_ranges[j]
-            
-            # 检查两个时间段是否重叠
-            if (range1['start'] < range2['end'] and range1['end'] > range2['start']):
-                conflict_msg = f"「{range1['task_name']}」和「{range2['task_name']}」时间重叠"
-                conflicts.append(conflict_msg)
+    # 按开始时间排序后扫描：后面的任务一旦开始得不早于当前任务结束，即可停止比较
+    time_ranges.sort()
+    for i, (start1, end1, name1) in enumerate(time_ranges):
+        for start2, end2, name2 in time_ranges[i + 1:]:
+            if start2 >= end1:
+                break
+            conflict_msg = f"「{name1}」和「{name2}」时间重叠"
+            conflicts.append(conflict_msg)
     
     return conflicts
 
-def calculate_duration(start_time, end_time):
-    """计算两个时间之间的时长（分钟）"""
-    if start_time and end_time:
-        duration = (end_time - start_time).total_seconds() / 60
-        return max(0, int(duration))
+def minutes_between(start_time, end_time):
+    """同一天内两个 time 之间的分钟数 - 不必先拼成 datetime"""
+    if end_time > start_time:
+        return (end_time.hour - start_time.hour) * 60 + (end_time.minute - start_time.minute)
     return 0
 
+@fragment
+def render_task_execution(i, task, saved_actual, current_date):
+    """渲染单个任务的实际执行输入 - 作为 fragment，修改某个任务只重跑该任务"""
+    st.markdown(f"##### {task['task_name']}")
+    
+    # 控件键和回调参数只构建一次，三个控件共用
+    start_key, end_key, energy_key = f"actual_start_{i}", f"actual_end_{i}", f"energy_input_{i}"
+    callback_args = (i, task, current_date)
+    session_state = st.session_state
+    
+    # 时间输入 - 2列布局
+    time_cols = st.columns(2)
+    with time_cols[0]:
+        # 从 session_state 获取实际开始时间 - 添加回调
+        start_value = session_state.get(start_key)
+        if start_value is None:
+            start_value = parse_time(saved_actual.get('actual_start_time', task['planned_start_time']))
+        actual_start_time = st.time_input(
+            "实际开始时间",
+            value=start_value,
+            key=start_key,
+            step=300,
+            on_change=update_actual_execution_data,
+            args=callback_args
+        )
+    
+    with time_cols[1]:
+        # 从 session_state 获取实际结束时间 - 添加回调
+        end_value = session_state.get(end_key)
+        if end_value is None:
+            end_value = parse_time(saved_actual.get('actual_end_time', task['planned_end_time']))
+        actual_end_time = st.time_input(
+            "实际结束时间",
+            value=end_value,
+            key=end_key,
+            step=300,
+            on_change=update_actual_execution_data,
+            args=callback_args
+        )
+        
+        # 时间无效时只提示：回调不会保存无效数据，无需触发整页重新运行
+        if actual_end_time <= actual_start_time:
+            st.error("❌ 实际结束时间必须在实际开始时间之后")
+
+    # 精力水平和时长显示 - 2列布局
+    info_cols = st.columns(2)
+    with info_cols[0]:
+        # 从 session_state 获取精力水平 - 添加回调
+        task_energy = st.select_slider(
+            "结束后精力", 
+            options=ENERGY_OPTIONS, 
+            value=session_state.get(energy_key, saved_actual.get('post_energy', 7)),
+            key=energy_key,
+            on_change=update_actual_execution_data,
+            args=callback_args
+        )
+    
+    with info_cols[1]:
+        # 计算实际时长
+        actual_duration = minutes_between(actual_start_time, actual_end_time)
+        st.markdown(f"##### 实际学习时长: {actual_duration}分钟")
+
 # 页面设置
 st.set_page_config(
     page_title="学习分析仪表板",
@@ -277,6 +375,9 @@ st.set_page_config(
     initial_sidebar_state="collapsed"  # 手机端默认收起侧边栏
 )
 
+# 侧边栏提示只在单次运行内去重，每次运行开始时清空记录，新的保存照常提示
+st.session_state.pop('_last_notify', None)
+
 # 初始化管理器
 @st.cache_resource
 def get_agent():
@@ -284,16 +385,78 @@ def get_agent():
 
 agent = get_agent()
 
+def get_data_version():
+    """学习数据版本戳 - 数据写入后随之变化，作为缓存键"""
+    if isinstance(data_manager, StudyDataManager):
+        # 本地存储以文件修改时间作为版本
+        return os.path.getmtime(data_manager.data_file)
+    # GitHub 存储使用数据管理器上的版本号：它在进程内共享，任一会话写入后所有会话的缓存一起失效
+    return data_manager.data_version
+
+@st.cache_resource(ttl=60, show_spinner=False)
+def load_study_data(data_version):
+    """加载全部学习数据（按版本戳缓存，避免每次 rerun 重新读取）；只读使用，共享同一份不做副本"""
+    return data_manager.load_all_data()
+
+@st.cache_resource(ttl=60, show_spinner=False)
+def load_recent_study_data(days, data_version):
+    """加载最近N天的学习数据（按版本戳缓存）；只读使用，共享同一份不做副本"""
+    return data_manager.get_recent_data(days)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_daily_metrics(days, data_version):
+    """最近N天每天的指标，按版本戳缓存，数据未变化时不重复计算"""
+    return [data_manager.calculate_daily_metrics(day) for day in load_recent_study_data(days, data_version)]
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_subject_frame(days, data_version):
+    """最近N天按学科汇总的计划/实际时间（小时），按版本戳缓存"""
+    import pandas as pd
+    subject_stats = data_manager.get_subject_stats(load_recent_study_data(days, data_version))
+    return pd.DataFrame.from_records(
+        [(sub, stats['actual_time'] / 60, stats['planned_time'] / 60) for sub, stats in subject_stats.items()],
+        columns=['subject', '实际时间', '计划时间']
+    )
+
+@st.cache_data(ttl=60, show_spinner=False)
+def load_history_dates(data_version):
+    """历史记录的日期列表（倒序），按版本戳缓存，切换日期时不必重新排序"""
+    return sorted((d['date'] for d in load_study_data(data_version)), reverse=True)
+
+@st.cache_resource(ttl=60, show_spinner=False)
+def load_records_by_date(data_version):
+    """日期 → 当日记录的索引，按版本戳缓存；只读使用，共享同一份不做副本"""
+    return {d['date']: d for d in load_study_data(data_version)}
+
+@st.cache_data(ttl=60, show_spinner=False)
+def export_study_data(data_version):
+    """导出用的完整数据 JSON 字节（按版本戳缓存，不必每次 rerun 重新序列化）"""
+    return dumps_json(load_study_data(data_version)).encode('utf-8')
+
+def clear_study_data_cache():
+    """数据被清理后清空学习数据缓存"""
+    load_study_data.clear()
+    load_recent_study_data.clear()
+    load_daily_metrics.clear()
+    load_subject_frame.clear()
+    load_history_dates.clear()
+    load_records_by_date.clear()
+    export_study_data.clear()
+
 # 初始化当前日期
 if 'current_date' not in st.session_state:
-    st.session_state.current_date = datetime.now().date()
+    st.session_state.current_date = TODAY
 
 # 初始化状态管理器
 github_state_manager.init_session_state()
 
-# 确保表单组件状态正确
+# 确保表单组件状态正确 - 任务列表被替换或日期变化时才整体刷新
+# 实时编辑是原地修改列表，列表对象不变，不会触发刷新
 if st.session_state.get('planned_tasks'):
-    update_all_form_components()
+    form_fingerprint = (id(st.session_state.planned_tasks), st.session_state.current_date)
+    if st.session_state.get('_form_fingerprint') != form_fingerprint:
+        update_all_form_components()
+        st.session_state._form_fingerprint = form_fingerprint
 
 # 侧边栏导航
 st.sidebar.title("📚 学习分析系统")
@@ -305,7 +468,7 @@ def create_plan_management_sidebar():
     st.sidebar.subheader("📋 计划管理")
     
     state_info = github_state_manager.get_state_info()
-    current_date = st.session_state.get('current_date', datetime.now().date())
+    current_date = st.session_state.get('current_date', TODAY)
     
     # 显示当前状态
     if state_info['date_status'] == 'today':
@@ -323,7 +486,7 @@ def create_plan_management_sidebar():
     # 切换到今天的按钮
     if state_info['date_status'] != 'today':
         if st.sidebar.button("🔄 切换到今天"):
-            today_date = datetime.now().date()
+            today_date = TODAY
             st.session_state.current_date = today_date
             github_state_manager._handle_plan_date_change(today_date.isoformat())
             update_all_form_components()
@@ -367,63 +530,59 @@ if hasattr(data_manager, 'get_sync_status'):
 # 主题颜色
 primary_color = "#1f77b4"
 
-def handle_page_refresh():
-    """处理页面刷新，确保状态正确恢复"""
-    current_plan_date = st.session_state.get('current_date', datetime.now().date())
+def restore_session_state():
+    """会话开始时恢复状态 - 每个会话只执行一次（页面刷新即开始新会话）"""
+    if st.session_state.get('_session_initialized'):
+        return
+    st.session_state._session_initialized = True
+    
+    current_plan_date = st.session_state.get('current_date', TODAY)
     plan_date_iso = current_plan_date.isoformat()
     
-    # 如果关键状态不存在，尝试从 GitHub 恢复
+    # 关键状态不存在（页面刷新），或当前日期还没有任何计划时，尝试从 GitHub 恢复
     critical_states = ['planned_tasks', 'tasks_confirmed', 'current_date']
     states_missing = any(state not in st.session_state for state in critical_states)
+    no_plan = not st.session_state.get('planned_tasks') and not st.session_state.get('tasks_confirmed')
+    if not (states_missing or no_plan):
+        return
     
-    if states_missing:
-        st.sidebar.info("🔄 检测到页面刷新，恢复状态中...")
-        if github_state_manager.load_from_github(plan_date_iso):
-            update_all_form_components()
-            st.sidebar.success(f"✅ {current_plan_date} 状态恢复成功")
+    st.sidebar.info("🔄 检测到页面刷新，恢复状态中...")
+    if github_state_manager.load_from_github(plan_date_iso):
+        update_all_form_components()
+        st.sidebar.success(f"✅ {current_plan_date} 状态恢复成功")
+        if states_missing:
             st.rerun()
+    else:
+        if current_plan_date == TODAY:
+            st.sidebar.info("📝 开始新的学习记录")
+        elif current_plan_date > TODAY:
+            st.sidebar.info(f"📝 开始 {current_plan_date} 的未来计划")
         else:
-            if current_plan_date == datetime.now().date():
-                st.sidebar.info("📝 开始新的学习记录")
-            elif current_plan_date > datetime.now().date():
-                st.sidebar.info(f"📝 开始 {current_plan_date} 的未来计划")
-            else:
-                st.sidebar.info(f"📝 开始 {current_plan_date} 的记录")
+            st.sidebar.info(f"📝 开始 {current_plan_date} 的记录")
+        # 调用日期变更处理来初始化状态
+        github_state_manager._handle_plan_date_change(plan_date_iso)
+        update_all_form_components()
 
-# 调用刷新处理
-handle_page_refresh()
+# 调用状态恢复（每个会话只在首次运行时生效）
+restore_session_state()
 
-def check_and_restore_state():
-    """检查并恢复状态 - 基于计划日期"""
-    current_plan_date = st.session_state.get('current_date', datetime.now().date())
-    plan_date_iso = current_plan_date.isoformat()
-    
-    # 如果 session_state 中没有数据，尝试从 GitHub 恢复
-    if not st.session_state.get('planned_tasks') and not st.session_state.get('tasks_confirmed'):
-        st.sidebar.info("🔄 正在尝试恢复状态...")
-        if github_state_manager.load_from_github(plan_date_iso):
-            update_all_form_components()
-            st.sidebar.success(f"✅ {current_plan_date} 的状态恢复成功！")
-        else:
-            # 调用日期变更处理来初始化状态
-            github_state_manager._handle_plan_date_change(plan_date_iso)
-            update_all_form_components()
-
-# 调用状态恢复检查
-check_and_restore_state()
+# 状态恢复完成后汇总一次状态信息，本次运行的后续部分共用
+state_info = github_state_manager.get_state_info()
 
-# 在侧边栏添加状态管理面板
+# 在侧边栏添加状态管理面板 - 作为 fragment，恢复、调试等操作只重跑本面板
+@fragment
 def create_state_sidebar():
-    st.sidebar.markdown("---")
-    st.sidebar.subheader("🔄 智能状态管理")
-    
+    # fragment 单独重跑时不会重新执行脚本顶部，状态信息在面板内现取
     state_info = github_state_manager.get_state_info()
     
+    st.markdown("---")
+    st.subheader("🔄 智能状态管理")
+    
     # 显示状态信息
     if state_info['last_save']:
-        st.sidebar.info(f"💾 最后保存: {state_info['last_save'].strftime('%H:%M:%S')}")
+        st.info(f"💾 最后保存: {state_info['last_save'].strftime('%H:%M:%S')}")
     
-    col1, col2 = st.sidebar.columns(2)
+    col1, col2 = st.columns(2)
     with col1:
         if state_info['date_status'] == 'today':
             status = "✅ 今天"
@@ -436,72 +595,79 @@ def create_state_sidebar():
         st.metric("任务", state_info['planned_task_count'])
     
     # 智能保存模式说明
-    st.sidebar.caption("🔍 智能保存模式：只在数据变化时保存")
+    st.caption("🔍 智能保存模式：只在数据变化时保存")
     
     # 手动恢复按钮
-    if st.sidebar.button("🔄 恢复状态"):
-        current_plan_date = st.session_state.get('current_date', datetime.now().date())
+    if st.button("🔄 恢复状态"):
+        current_plan_date = st.session_state.get('current_date', TODAY)
         plan_date_iso = current_plan_date.isoformat()
         if github_state_manager.load_from_github(plan_date_iso):
             update_all_form_components()
-            st.sidebar.success("状态恢复成功!")
+            st.success("状态恢复成功!")
             st.rerun()
         else:
-            st.sidebar.error("状态恢复失败!")
-    
+            st.error("状态恢复失败!")
+
+# 手动保存和切换日期会调用直接写 st.sidebar 的状态管理器方法，fragment 内不允许，放在 fragment 之外
+def create_state_actions(state_info):
     # 手动保存按钮（用于特殊情况）
-    if st.sidebar.button("💾 手动保存"):
+    if st.button("💾 手动保存"):
         if github_state_manager.manual_save_state():
-            st.sidebar.success("手动保存成功!")
+            st.success("手动保存成功!")
         else:
-            st.sidebar.error("手动保存失败!")
+            st.error("手动保存失败!")
     
     # 状态日期提醒
     if state_info['date_status'] != 'today':
         current_date = st.session_state.get('current_date')
         if current_date:
             if state_info['date_status'] == 'future':
-                st.sidebar.warning(f"📅 未来计划: {current_date}")
+                st.warning(f"📅 未来计划: {current_date}")
             else:
-                st.sidebar.info(f"📅 过往记录: {current_date}")
+                st.info(f"📅 过往记录: {current_date}")
         
-        if st.sidebar.button("🆕 切换到今天"):
-            today_date = datetime.now().date()
+        if st.button("🆕 切换到今天"):
+            today_date = TODAY
             st.session_state.current_date = today_date
             github_state_manager._handle_plan_date_change(today_date.isoformat())
             update_all_form_components()
             st.rerun()
-    
-    # 在侧边栏底部添加调试信息
-    with st.sidebar.expander("🔧 调试信息"):
+
+# 在侧边栏底部添加调试信息 - 折叠的 expander 内容仍会执行，用复选框控制是否计算
+@fragment
+def create_debug_sidebar():
+    if st.checkbox("显示调试信息", key="show_debug"):
         state_info = github_state_manager.get_state_info()
-        st.write("GitHub 连接:", "✅ 已连接" if state_info['github_connected'] else "❌ 未连接")
-        st.write("计划日期:", state_info['plan_date'])
-        st.write("计划任务数:", state_info['planned_task_count'])
-        st.write("任务确认:", state_info['tasks_confirmed'])
-        st.write("日期状态:", state_info['date_status'])
-        st.write("距今天数:", state_info['days_from_today'])
-        st.write("空状态检查:", "✅ 是" if github_state_manager._is_empty_state() else "❌ 否")
+        with st.expander("🔧 调试信息", expanded=True):
+            st.write("GitHub 连接:", "✅ 已连接" if state_info['github_connected'] else "❌ 未连接")
+            st.write("计划日期:", state_info['plan_date'])
+            st.write("计划任务数:", state_info['planned_task_count'])
+            st.write("任务确认:", state_info['tasks_confirmed'])
+            st.write("日期状态:", state_info['date_status'])
+            st.write("距今天数:", state_info['days_from_today'])
+            st.write("空状态检查:", "✅ 是" if github_state_manager._is_empty_state() else "❌ 否")
         
-        # 显示保存的状态文件内容（调试用）
-        if st.button("查看GitHub保存的状态"):
-            current_plan_date = st.session_state.get('current_date', datetime.now().date())
-            plan_date_iso = current_plan_date.isoformat()
-            all_states = github_state_manager._load_all_states_from_github()
-            if plan_date_iso in all_states:
-                st.json(all_states[plan_date_iso])
-                # 显示状态哈希对比
-                current_hash = github_state_manager._get_state_hash()
-                saved_data = all_states[plan_date_iso]
-                saved_hash = hashlib.md5(json.dumps(saved_data, sort_keys=True).encode()).hexdigest()
-                st.write("当前状态哈希:", current_hash[:8])
-                st.write("保存状态哈希:", saved_hash[:8])
-                st.write("状态一致:", current_hash == saved_hash)
-            else:
-                st.info(f"{plan_date_iso} 没有保存的状态")
+            # 显示保存的状态文件内容（调试用）
+            if st.button("查看GitHub保存的状态"):
+                current_plan_date = st.session_state.get('current_date', TODAY)
+                plan_date_iso = current_plan_date.isoformat()
+                all_states = github_state_manager._load_all_states_from_github()
+                if plan_date_iso in all_states:
+                    st.json(all_states[plan_date_iso])
+                    # 显示状态哈希对比（与上次保存时记录的哈希比较）
+                    current_hash = github_state_manager._get_state_hash()
+                    saved_hash = st.session_state.get('last_state_hash') or ''
+                    st.write("当前状态哈希:", current_hash[:8])
+                    st.write("保存状态哈希:", saved_hash[:8])
+                    st.write("状态一致:", current_hash == saved_hash)
+                else:
+                    st.info(f"{plan_date_iso} 没有保存的状态")
 
-# 在页面中调用
-create_state_sidebar()
+# 在页面中调用（fragment 内不能直接使用 st.sidebar，在调用处放入侧边栏）
+with st.sidebar:
+    create_state_sidebar()
+    create_state_actions(state_info)
+    create_debug_sidebar()
 
 st.markdown("""
     <style>
@@ -547,9 +713,7 @@ st.markdown("""
 # 页面1: 今日记录
 if page == "今日记录":
     current_date = st.session_state.get('current_date')
-    today = datetime.now().date()
-    
-    state_info = github_state_manager.get_state_info()
+    today = TODAY
     
     if state_info['date_status'] == 'today':
         st.markdown(f"##### 📝 今日学习记录")
@@ -585,15 +749,17 @@ if page == "今日记录":
         weather_options = ["晴", "多云", "雨", "阴", "雪"]
         current_weather_index = weather_options.index(current_weather_value) if current_weather_value in weather_options else 0
         
-        current_weather = st.selectbox("天气", weather_options, index=current_weather_index, key="weather_input")
-        if current_weather != st.session_state.get('current_weather'):
-            st.session_state.current_weather = current_weather
+        current_weather = st.selectbox(
+            "天气", weather_options, index=current_weather_index, key="weather_input",
+            on_change=sync_widget_to_state, args=("weather_input", "current_weather")
+        )
             
     with info_cols[3]:
         current_energy_level_value = st.session_state.get('current_energy_level', 7)
-        current_energy_level = st.slider("精力水平", 1, 10, value=current_energy_level_value, key="energy_input")
-        if current_energy_level != st.session_state.get('current_energy_level'):
-            st.session_state.current_energy_level = current_energy_level
+        current_energy_level = st.slider(
+            "精力水平", 1, 10, value=current_energy_level_value, key="energy_input",
+            on_change=sync_widget_to_state, args=("energy_input", "current_energy_level")
+        )
     
     # === 计划任务区域 - 响应式设计 ===
     st.markdown(f"###### 📋 计划任务")
@@ -623,16 +789,10 @@ if page == "今日记录":
                         start_hour = 9 + i
                         start_minute = 0
                     
-                    new_task = {
-                        'task_id': i + 1,
-                        'task_name': '',
-                        'subject': 'math',
-                        'difficulty': 3,
-                        'planned_start_time': time(start_hour, start_minute),
-                        'planned_end_time': time(start_hour + 1, start_minute),
-                        'planned_duration': 60,
-                        'planned_focus_duration': 48
-                    }
+                    new_task = TASK_DEFAULT_TEMPLATE.copy()
+                    new_task['task_id'] = i + 1
+                    new_task['planned_start_time'] = time(start_hour, start_minute)
+                    new_task['planned_end_time'] = time(start_hour + 1, start_minute)
                     planned_tasks.append(new_task)
             else:
                 # 删除多余任务
@@ -640,21 +800,22 @@ if page == "今日记录":
             
             st.session_state.planned_tasks = planned_tasks
             github_state_manager.auto_save_state()
-            update_all_form_components()
+            st.session_state._form_fingerprint = None
             st.rerun()
         
+        # 循环外读取一次已保存的任务，避免每个任务重复访问 session_state
+        saved_tasks = st.session_state.get('planned_tasks', [])
+        session_get = st.session_state.get
         for i in range(task_count):
             st.markdown(f"###### 任务 {i+1}")
             
             # 从当前日期的缓存数据中获取默认值
-            saved_task = {}
-            if i < len(st.session_state.get('planned_tasks', [])):
-                saved_task = st.session_state.planned_tasks[i]
+            saved_task = saved_tasks[i] if i < len(saved_tasks) else {}
             
             # 任务名称 - 使用 on_change 回调实时更新
             task_name = st.text_input(
                 "任务名称", 
-                value=st.session_state.get(f"task_name_{i}", saved_task.get('task_name', '')),
+                value=session_get(f"task_name_{i}", saved_task.get('task_name', '')),
                 key=f"task_name_{i}",
                 placeholder="输入任务名称",
                 on_change=lambda i=i: update_task_data_in_realtime(i, current_date)
@@ -663,20 +824,19 @@ if page == "今日记录":
             # 学科和难度
             col1, col2 = st.columns(2)
             with col1:
-                subject_options = ["math", "physics", "econ", "cs", "other"]
-                subject_default = st.session_state.get(f"subject_{i}", saved_task.get('subject', 'math'))
-                subject_index = subject_options.index(subject_default) if subject_default in subject_options else 0
+                subject_default = session_get(f"subject_{i}", saved_task.get('subject', 'math'))
+                subject_index = SUBJECT_OPTIONS.index(subject_default) if subject_default in SUBJECT_OPTIONS else 0
                 
                 subject = st.selectbox(
                     "学科", 
-                    subject_options,
+                    SUBJECT_OPTIONS,
                     index=subject_index,
                     key=f"subject_{i}",
                     on_change=lambda i=i: update_task_data_in_realtime(i, current_date)
                 )
             
             with col2:
-                difficulty_default = st.session_state.get(f"difficulty_{i}", saved_task.get('difficulty', 3))
+                difficulty_default = session_get(f"difficulty_{i}", saved_task.get('difficulty', 3))
                 difficulty_index = difficulty_default - 1 if 1 <= difficulty_default <= 5 else 2
                 
                 difficulty = st.selectbox(
@@ -690,7 +850,7 @@ if page == "今日记录":
             # 时间设置
             time_cols = st.columns(2)
             with time_cols[0]:
-                start_time_value = st.session_state.get(f"start_{i}", saved_task.get('planned_start_time', time(9+i, 0)))
+                start_time_value = session_get(f"start_{i}") or saved_task.get('planned_start_time') or time(9+i, 0)
                 if isinstance(start_time_value, str):
                     start_time_value = parse_time(start_time_value)
                 
@@ -703,7 +863,7 @@ if page == "今日记录":
                 )
             
             with time_cols[1]:
-                end_time_value = st.session_state.get(f"end_{i}", saved_task.get('planned_end_time', time(10+i, 0)))
+                end_time_value = session_get(f"end_{i}") or saved_task.get('planned_end_time') or time(10+i, 0)
                 if isinstance(end_time_value, str):
                     end_time_value = parse_time(end_time_value)
                 
@@ -716,9 +876,7 @@ if page == "今日记录":
                 )
 
             # 显示时长
-            start_dt = datetime.combine(current_date, start_time)
-            end_dt = datetime.combine(current_date, end_time)
-            calculated_duration = calculate_duration(start_dt, end_dt)
+            calculated_duration = minutes_between(start_time, end_time)
             st.info(f"计划时长: {calculated_duration}分钟")
 
         # 计划任务确认逻辑 - 响应式按钮布局
@@ -755,10 +913,12 @@ if page == "今日记录":
                             for conflict in time_conflicts:
                                 st.error(f"- {conflict}")
                         else:
+                            # 保存控件中的最新任务：时间统一为 time 对象，之后每次运行无需再解析
+                            st.session_state.planned_tasks = planned_tasks
                             st.session_state.tasks_confirmed = True
                             st.session_state.show_final_confirmation = False
                             st.session_state.expander_expanded = False
-                            github_state_manager.auto_save_state()
+                            github_state_manager.flush_pending_save()
                             if current_date == today:
                                 st.success(f"✅ 已确认 {len(planned_tasks)} 个今日计划任务！")
                             elif current_date > today:
@@ -785,7 +945,8 @@ if page == "今日记录":
                             st.error(f"- {conflict}")
                     else:
                         st.session_state.show_final_confirmation = True
-                        github_state_manager.auto_save_state()
+                        # 确认前写入此前被频率控制推迟的编辑
+                        github_state_manager.flush_pending_save()
                         st.rerun()
                 else:
                     st.error("❌ 请至少填写一个有效的任务名称")
@@ -794,40 +955,41 @@ if page == "今日记录":
     if st.session_state.get('planned_tasks') and st.session_state.get('tasks_confirmed'):
         st.markdown(f"##### 📅 今日计划时间线")
         
-        # 创建时间线数据
-        timeline_data = []
+        # 时间统一格式化为 'HH:MM'，得到的任务列表同时用于时间线和提交保存
+        planned_tasks_serialized = []
+        total_planned = 0
         planned_tasks = st.session_state.get('planned_tasks', [])
         for task in planned_tasks:
+            # 总计划时长在构建时间线时顺带累计，不再单独遍历
+            total_planned += task['planned_duration']
+            
             # 确保任务有时间数据
             if 'planned_start_time' in task and 'planned_end_time' in task:
                 try:
-                    start_dt = datetime.combine(current_date, parse_time(task.get('planned_start_time')))
-                    end_dt = datetime.combine(current_date, parse_time(task.get('planned_end_time')))
-                    
-                    timeline_data.append({
-                        'Task': task['task_name'],
-                        'Start': start_dt,
-                        'Finish': end_dt,
-                        'Duration': f"{task['planned_duration']}分钟",
-                        'Subject': task['subject'],
-                        'Difficulty': task['difficulty']
+                    planned_tasks_serialized.append({
+                        **task,
+                        'planned_start_time': to_hhmm(task['planned_start_time']),
+                        'planned_end_time': to_hhmm(task['planned_end_time'])
                     })
                 except Exception as e:
                     # 如果时间解析失败，跳过这个任务
                     continue
 
-        # 按照开始时间排序
-        timeline_data.sort(key=lambda x: x['Start'])
+        # 按照开始时间排序，只排序一次；'HH:MM' 的字典序即时间顺序
+        planned_tasks_serialized.sort(key=lambda x: x['planned_start_time'])
         
-        # 显示时间线表格
-        if timeline_data:
-            df_timeline = pd.DataFrame(timeline_data)
-            df_display = df_timeline[['Task', 'Subject', 'Start', 'Finish', 'Duration', 'Difficulty']].copy()
-            df_display['Start'] = df_display['Start'].dt.strftime('%H:%M')
-            df_display['Finish'] = df_display['Finish'].dt.strftime('%H:%M')
-            
+        # 显示时间线表格 - 按列组织数据，表格无需逐行推断列
+        if planned_tasks_serialized:
+            timeline_columns = {
+                'Task': [t['task_name'] for t in planned_tasks_serialized],
+                'Subject': [t['subject'] for t in planned_tasks_serialized],
+                'Start': [t['planned_start_time'] for t in planned_tasks_serialized],
+                'Finish': [t['planned_end_time'] for t in planned_tasks_serialized],
+                'Duration': [f"{t['planned_duration']}分钟" for t in planned_tasks_serialized],
+                'Difficulty': [t['difficulty'] for t in planned_tasks_serialized]
+            }
             st.dataframe(
-                df_display,
+                timeline_columns,
                 use_container_width=True,
                 column_config={
                     "Task": "任务名称",
@@ -840,74 +1002,33 @@ if page == "今日记录":
             )
             
             # 显示总时长统计
-            total_planned = sum(task['planned_duration'] for task in planned_tasks)
             st.info(f"📊 今日总计划学习时间: {total_planned}分钟 ({total_planned/60:.1f}小时)")
     
     # === 实际执行情况 - 响应式设计 ===
     if st.session_state.get('planned_tasks') and st.session_state.get('tasks_confirmed'):
         st.markdown(f"##### ✅ 实际执行情况")
-        # 按照开始时间排序
+        # 按照开始时间排序 - 时间线已解析并排好序，直接复用，不再逐个解析时间
         planned_tasks = st.session_state.get('planned_tasks', [])
-        sorted_tasks = sorted(planned_tasks, key=lambda x: parse_time(x['planned_start_time']))
+        sorted_tasks = planned_tasks_serialized
+        actual_execution = st.session_state.get('actual_execution', [])
 
         for i, task in enumerate(sorted_tasks):
-            st.markdown(f"##### {task['task_name']}")
-            
             # 从保存数据中获取实际执行信息
-            actual_execution = st.session_state.get('actual_execution', [])
             saved_actual = actual_execution[i] if i < len(actual_execution) else {}
-            
-            # 时间输入 - 2列布局
-            time_cols = st.columns(2)
-            with time_cols[0]:
-                # 从 session_state 获取实际开始时间 - 添加回调
-                actual_start_time = st.time_input(
-                    "实际开始时间",
-                    value=st.session_state.get(f"actual_start_{i}", parse_time(saved_actual.get('actual_start_time', task['planned_start_time']))),
-                    key=f"actual_start_{i}",
-                    step=300,
-                    on_change=lambda i=i, task=task: update_actual_execution_data(i, task, current_date)
-                )
-            
-            with time_cols[1]:
-                # 从 session_state 获取实际结束时间 - 添加回调
-                actual_end_time = st.time_input(
-                    "实际结束时间",
-                    value=st.session_state.get(f"actual_end_{i}", parse_time(saved_actual.get('actual_end_time', task['planned_end_time']))),
-                    key=f"actual_end_{i}",
-                    step=300,
-                    on_change=lambda i=i, task=task: update_actual_execution_data(i, task, current_date)
-                )
-                
-                if actual_end_time <= actual_start_time:
-                    st.error("❌ 实际结束时间必须在实际开始时间之后")
-                    time_module.sleep(0.1)
-                    st.rerun()
-
-            # 精力水平和时长显示 - 2列布局
-            info_cols = st.columns(2)
-            with info_cols[0]:
-                # 从 session_state 获取精力水平 - 添加回调
-                task_energy = st.select_slider(
-                    "结束后精力", 
-                    options=[1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 
-                    value=st.session_state.get(f"energy_input_{i}", saved_actual.get('post_energy', 7)),
-                    key=f"energy_input_{i}",
-                    on_change=lambda i=i, task=task: update_actual_execution_data(i, task, current_date)
-                )
-            
-            with info_cols[1]:
-                # 计算实际时长
-                start_dt = datetime.combine(current_date, actual_start_time)
-                end_dt = datetime.combine(current_date, actual_end_time)
-                actual_duration = calculate_duration(start_dt, end_dt)
-                st.markdown(f"##### 实际学习时长: {actual_duration}分钟")
+            render_task_execution(i, task, saved_actual, current_date)
 
         # === 反思和操作区域 ===
         st.markdown(f"##### 📝 学习反思")
 
-        # 暂存按钮
-        st.button("💾 暂存当前进度", use_container_width=True)
+        # 暂存按钮 - 把频率控制下暂未写入的修改一次性写入 GitHub
+        if st.button("💾 暂存当前进度", use_container_width=True):
+            if not github_state_manager.github_manager.is_connected():
+                # 本地存储模式没有可写入的状态文件，进度只保留在当前会话中
+                st.info("📝 未连接 GitHub，当前进度仅保存在本次会话中")
+            elif github_state_manager.flush_pending_save():
+                st.success("✅ 当前进度已暂存")
+            else:
+                st.error("❌ 暂存失败，请稍后重试")
         
         # 反思框
         current_reflection_value = st.session_state.get('current_reflection', "")
@@ -915,13 +1036,9 @@ if page == "今日记录":
             "今日反思", 
             value=current_reflection_value,
             placeholder="今天的收获和改进点...", 
-            key="reflection_input"
+            key="reflection_input",
+            on_change=update_reflection
         )
-        # 反思内容变化时智能保存
-        if (current_reflection != st.session_state.get('current_reflection') and 
-            current_reflection.strip()):
-            st.session_state.current_reflection = current_reflection
-            github_state_manager.auto_save_state()
         
         # 最终提交按钮
         st.markdown(f"##### 完成记录")
@@ -937,14 +1054,19 @@ if page == "今日记录":
                 
                 # 处理实际执行数据
                 actual_execution_for_save = []
+                actual_execution_for_save_formatted = []
+                # 循环内多次读取 session_state，先绑定到局部变量
+                session_get = st.session_state.get
                 for i, task in enumerate(sorted_tasks):
-                    actual_start_time = st.session_state.get(f"actual_start_{i}", parse_time(task['planned_start_time']))
-                    actual_end_time = st.session_state.get(f"actual_end_{i}", parse_time(task['planned_end_time']))
-                    task_energy = st.session_state.get(f"energy_input_{i}", 7)
+                    actual_start_time = session_get(f"actual_start_{i}")
+                    if actual_start_time is None:
+                        actual_start_time = parse_time(task['planned_start_time'])
+                    actual_end_time = session_get(f"actual_end_{i}")
+                    if actual_end_time is None:
+                        actual_end_time = parse_time(task['planned_end_time'])
+                    task_energy = session_get(f"energy_input_{i}", 7)
                     
-                    start_dt = datetime.combine(current_date, actual_start_time)
-                    end_dt = datetime.combine(current_date, actual_end_time)
-                    actual_duration = calculate_duration(start_dt, end_dt)
+                    actual_duration = minutes_between(actual_start_time, actual_end_time)
                     
                     actual_data = {
                         "task_id": task['task_id'],
@@ -956,32 +1078,32 @@ if page == "今日记录":
                         "completed": True
                     }
                     actual_execution_for_save.append(actual_data)
+                    # 控件返回的一定是 time 对象，构建时直接生成保存格式
+                    actual_execution_for_save_formatted.append({
+                        **actual_data,
+                        "actual_start_time": actual_start_time.strftime('%H:%M'),
+                        "actual_end_time": actual_end_time.strftime('%H:%M')
+                    })
                 
                 st.session_state.actual_execution = actual_execution_for_save
                 st.session_state.tasks_saved = True
-                github_state_manager.auto_save_state()
+                github_state_manager.flush_pending_save()
                 
                 # 保存到数据管理器
                 try:
-                    # 确保数据格式正确
-                    planned_tasks_for_save = []
-                    for task in sorted_tasks:
-                        task_copy = task.copy()
-                        if 'planned_start_time' in task_copy:
-                            task_copy['planned_start_time'] = parse_time(task_copy['planned_start_time']).strftime('%H:%M')
-                        if 'planned_end_time' in task_copy:
-                            task_copy['planned_end_time'] = parse_time(task_copy['planned_end_time']).strftime('%H:%M')
-                        planned_tasks_for_save.append(task_copy)
+                    # 计划任务的时间在时间线中已转为字符串
+                    planned_tasks_for_save = planned_tasks_serialized
+                    
+                    # 每个列表只遍历一次，同时累计总时长和专注时长
+                    planned_total_time = planned_focus_time = 0
+                    for t in planned_tasks:
+                        planned_total_time += t['planned_duration']
+                        planned_focus_time += t['planned_focus_duration']
                     
-                    actual_execution_for_save_formatted = []
-                    for execution in actual_execution_for_save:
-                        exec_copy = execution.copy()
-                        # 确保时间是字符串格式
-                        if 'actual_start_time' in exec_copy:
-                            exec_copy['actual_start_time'] = parse_time(exec_copy['actual_start_time']).strftime('%H:%M')
-                        if 'actual_end_time' in exec_copy:
-                            exec_copy['actual_end_time'] = parse_time(exec_copy['actual_end_time']).strftime('%H:%M')
-                        actual_execution_for_save_formatted.append(exec_copy)
+                    actual_total_time = actual_focus_time = 0
+                    for t in actual_execution_for_save:
+                        actual_total_time += t['actual_duration']
+                        actual_focus_time += t['actual_focus_duration']
                     
                     success = data_manager.add_daily_record(
                         current_date.strftime("%Y-%m-%d"),
@@ -990,10 +1112,10 @@ if page == "今日记录":
                         planned_tasks_for_save,
                         actual_execution_for_save_formatted,
                         {
-                            "planned_total_time": sum(t['planned_duration'] for t in planned_tasks),
-                            "actual_total_time": sum(t['actual_duration'] for t in actual_execution_for_save),
-                            "planned_focus_time": sum(t['planned_focus_duration'] for t in planned_tasks),
-                            "actual_focus_time": sum(t['actual_focus_duration'] for t in actual_execution_for_save),
+                            "planned_total_time": planned_total_time,
+                            "actual_total_time": actual_total_time,
+                            "planned_focus_time": planned_focus_time,
+                            "actual_focus_time": actual_focus_time,
                             "completion_rate": len(actual_execution_for_save) / len(planned_tasks) if planned_tasks else 0,
                             "reflection": current_reflection
                         }
@@ -1001,7 +1123,6 @@ if page == "今日记录":
                     
                     if success:
                         st.balloons()
-                        state_info = github_state_manager.get_state_info()
                         if state_info['date_status'] == 'today':
                             st.success("🎉 今日记录保存成功！")
                         elif state_info['date_status'] == 'future':
@@ -1023,51 +1144,62 @@ if page == "今日记录":
             st.info("👆 请先确认今日的计划任务")          
 
 elif page == "数据看板":
+    # 图表相关依赖较重，只在看板页面导入
+    import plotly.express as px
+    import plotly.graph_objects as go
+    
     st.title("📊 学习数据看板")
     
-    data = data_manager.get_recent_data(30)
-    if not data:
+    data_version = get_data_version()
+    # 每天的指标按数据版本缓存，指标卡片和趋势图共用；数据量很小，直接用列表计算
+    metrics = load_daily_metrics(30, data_version)
+    if not metrics:
         st.info("暂无数据，请先记录今日学习情况")
         st.stop()
     
     # 指标卡片
-    recent_metrics = [data_manager.calculate_daily_metrics(day) for day in data[-7:]]
+    recent_metrics = metrics[-7:]
     if recent_metrics:
+        # 一次遍历同时累计四个指标，再分别显示
+        completion_sum = efficiency_sum = focus_sum = accuracy_sum = 0
+        for m in recent_metrics:
+            completion_sum += m['completion_rate']
+            efficiency_sum += m['focus_efficiency']
+            focus_sum += m['total_focus_time']
+            accuracy_sum += m['planning_accuracy']
+        recent_count = len(recent_metrics)
+        
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            avg_completion = pd.DataFrame(recent_metrics)['completion_rate'].mean()
-            st.metric("平均完成率", f"{avg_completion:.1%}")
+            st.metric("平均完成率", f"{completion_sum / recent_count:.1%}")
         with col2:
-            avg_efficiency = pd.DataFrame(recent_metrics)['focus_efficiency'].mean()
-            st.metric("平均专注效率", f"{avg_efficiency:.1%}")
+            st.metric("平均专注效率", f"{efficiency_sum / recent_count:.1%}")
         with col3:
-            total_focus = pd.DataFrame(recent_metrics)['total_focus_time'].sum() / 60
-            st.metric("总专注时间", f"{total_focus:.1f}小时")
+            st.metric("总专注时间", f"{focus_sum / 60:.1f}小时")
         with col4:
-            avg_accuracy = pd.DataFrame(recent_metrics)['planning_accuracy'].mean()
-            st.metric("计划准确性", f"{avg_accuracy:.1%}")
+            st.metric("计划准确性", f"{accuracy_sum / recent_count:.1%}")
     
     # 趋势图表
     col1, col2 = st.columns(2)
     
     with col1:
-        df_metrics = pd.DataFrame([data_manager.calculate_daily_metrics(day) for day in data])
-        if not df_metrics.empty:
-            fig = go.Figure()
-            fig.add_trace(go.Scatter(x=df_metrics['date'], y=df_metrics['completion_rate'], 
-                                   name='完成率', line=dict(color=primary_color)))
-            fig.add_trace(go.Scatter(x=df_metrics['date'], y=df_metrics['focus_efficiency'], 
-                                   name='专注效率', line=dict(color='#ff7f0e')))
-            fig.update_layout(title="学习效率趋势", xaxis_title="日期", yaxis_title="比率")
+        if metrics:
+            dates = [m['date'] for m in metrics]
+            # 一次性传入全部 trace 和布局，避免逐个 add_trace 的重复校验
+            fig = go.Figure(
+                data=[
+                    go.Scatter(x=dates, y=[m['completion_rate'] for m in metrics], 
+                               name='完成率', line=dict(color=primary_color)),
+                    go.Scatter(x=dates, y=[m['focus_efficiency'] for m in metrics], 
+                               name='专注效率', line=dict(color='#ff7f0e'))
+                ],
+                layout=go.Layout(title="学习效率趋势", xaxis_title="日期", yaxis_title="比率")
+            )
             st.plotly_chart(fig, use_container_width=True)
     
     with col2:
-        subject_stats = data_manager.get_subject_stats(data)
-        if subject_stats:
-            df_subject = pd.DataFrame([
-                {'subject': sub, '实际时间': stats['actual_time']/60, '计划时间': stats['planned_time']/60}
-                for sub, stats in subject_stats.items()
-            ])
+        df_subject = load_subject_frame(30, data_version)
+        if not df_subject.empty:
             fig = px.bar(df_subject, x='subject', y=['计划时间', '实际时间'], 
                         title="各学科时间分配", barmode='group')
             st.plotly_chart(fig, use_container_width=True)
@@ -1076,7 +1208,7 @@ elif page == "数据看板":
 elif page == "智能分析":
     st.title("🤖 智能分析助手")
     
-    data = data_manager.get_recent_data(14)
+    data = load_recent_study_data(14, get_data_version())
     if len(data) < 3:
         st.warning("请至少积累3天的数据以获得有意义的分析")
         st.stop()
@@ -1103,16 +1235,17 @@ elif page == "智能分析":
 elif page == "历史数据":
     st.title("📋 历史记录浏览")
     
-    data = data_manager.load_all_data()
-    if not data:
+    data_version = get_data_version()
+    records_by_date = load_records_by_date(data_version)
+    if not records_by_date:
         st.info("暂无历史数据")
         st.stop()
     
     # 日期筛选
-    dates = sorted([d['date'] for d in data], reverse=True)
+    dates = load_history_dates(data_version)
     selected_date = st.selectbox("选择日期查看详情", dates)
     
-    selected_data = next((d for d in data if d['date'] == selected_date), None)
+    selected_data = records_by_date.get(selected_date)
     if selected_data:
         col1, col2 = st.columns(2)
         
@@ -1123,11 +1256,15 @@ elif page == "历史数据":
             st.write(f"**精力水平**: {selected_data['energy_level']}/10")
             
             st.subheader("📋 计划任务")
+            # 拼成一段 Markdown 一次输出，避免每个任务一个元素
+            task_lines = []
             for task in selected_data['planned_tasks']:
                 if 'planned_start_time' in task and 'planned_end_time' in task:
-                    st.write(f"- {task['task_name']} ({task['subject']}): {task['planned_start_time']} - {task['planned_end_time']} ({task['planned_duration']}分钟)")
+                    task_lines.append(f"- {task['task_name']} ({task['subject']}): {task['planned_start_time']} - {task['planned_end_time']} ({task['planned_duration']}分钟)")
                 else:
-                    st.write(f"- {task['task_name']} ({task['subject']}): {task['planned_duration']}分钟")
+                    task_lines.append(f"- {task['task_name']} ({task['subject']}): {task['planned_duration']}分钟")
+            if task_lines:
+                st.markdown("\n".join(task_lines))
         
         with col2:
             st.subheader("✅ 执行情况")
@@ -1193,14 +1330,14 @@ GITHUB_REPO=仓库名""", language="ini")
                 # 数据操作
                 st.subheader("📊 数据操作")
                 
-                all_data = data_manager.load_all_data()
+                data_version = get_data_version()
+                all_data = load_study_data(data_version)
                 if all_data:
                     # 导出数据
-                    json_data = json.dumps(all_data, ensure_ascii=False, indent=2)
                     st.download_button(
                         "💾 导出完整数据",
-                        data=json_data,
-                        file_name=f"study_data_backup_{datetime.now().strftime('%Y%m%d')}.json",
+                        data=export_study_data(data_version),
+                        file_name=f"study_data_backup_{TODAY.strftime('%Y%m%d')}.json",
                         help="下载完整的 JSON 数据备份"
                     )
                     
@@ -1249,6 +1386,7 @@ GITHUB_REPO=仓库名""", language="ini")
         days_to_keep = st.slider("保留最近多少天的数据", 7, 365, 30, key="days_keep")
         if st.button("🧹 清理旧数据", key="clean_old", help=f"删除{days_to_keep}天前的数据"):
             if github_state_manager.cleanup_data(days_to_keep=days_to_keep):
+                clear_study_data_cache()
                 st.rerun()
     
     with tab2:
@@ -1271,12 +1409,17 @@ GITHUB_REPO=仓库名""", language="ini")
         if confirm1 and confirm2:
             if st.button("🗑️ 确认删除所有数据", type="primary", key="delete_all"):
                 if github_state_manager.cleanup_data(clear_all=True):
+                    clear_study_data_cache()
                     st.rerun()
         else:
             st.button("🗑️ 确认删除所有数据", disabled=True)
     
     st.info("💡 建议定期清理缓存和旧数据以保持应用性能")
 
+# 空闲时写入被频率控制推迟的修改（间隔未到时继续推迟）
+if st.session_state.get('save_pending', False):
+    github_state_manager.auto_save_state()
+
 # 运行说明
 st.sidebar.markdown("---")
 st.sidebar.info("""
@@ -1,11 +1,21 @@
 import json
-import pandas as pd
+from bisect import bisect_left
 from datetime import datetime, timedelta
 import os
 
+try:
+    import orjson
+except ImportError:
+    # 未安装 orjson 时回退到标准库 json
+    orjson = None
+
 class StudyDataManager:
     def __init__(self, data_file="study_data.jsonl"):
         self.data_file = data_file
+        self._data_cache = None
+        self._data_cache_mtime = None
+        self._sorted_records = []
+        self._sorted_dates = []
         self._ensure_data_file()
     
     def _ensure_data_file(self):
@@ -25,27 +35,46 @@ class StudyDataManager:
             "timestamp": datetime.now().isoformat()
         }
         
-        with open(self.data_file, "a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # 直接以字节追加一行，优先使用 orjson 序列化
+        if orjson is not None:
+            line = orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+        else:
+            line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with open(self.data_file, "ab") as f:
+            f.write(line)
+        self._data_cache = None
         return True
     
-    def load_all_data(self):
-        """加载所有历史数据"""
-        data = []
+    def _refresh_cache(self):
+        """文件修改后重新解析，并按日期建立有序索引；文件不存在时返回 False"""
         try:
-            with open(self.data_file, "r", encoding="utf-8") as f:
-                for line in f:
-                    if line.strip():
-                        data.append(json.loads(line))
-        except FileNotFoundError:
-            pass
-        return data
+            mtime = os.path.getmtime(self.data_file)
+        except OSError:
+            return False
+        
+        if self._data_cache is None or self._data_cache_mtime != mtime:
+            # 一次读入整个文件再逐行解析，优先使用 orjson
+            loads = orjson.loads if orjson is not None else json.loads
+            with open(self.data_file, "rb") as f:
+                self._data_cache = [loads(line) for line in f.read().splitlines() if line.strip()]
+            self._data_cache_mtime = mtime
+            # 按日期排序的记录和日期列表，供 get_recent_data 二分查找
+            self._sorted_records = sorted(self._data_cache, key=lambda d: d['date'])
+            self._sorted_dates = [d['date'] for d in self._sorted_records]
+        return True
+    
+    def load_all_data(self):
+        """加载所有历史数据 - 文件未修改时直接复用上次解析的结果"""
+        if not self._refresh_cache():
+            return []
+        return list(self._data_cache)
     
     def get_recent_data(self, days=30):
-        """获取最近N天的数据"""
-        all_data = self.load_all_data()
+        """获取最近N天的数据（按日期升序）"""
+        if not self._refresh_cache():
+            return []
         cutoff_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
-        return [d for d in all_data if d['date'] >= cutoff_date]
+        return self._sorted_records[bisect_left(self._sorted_dates, cutoff_date):]
     
     def calculate_daily_metrics(self, data):
         """计算每日指标"""
@@ -63,7 +92,7 @@ class StudyDataManager:
             'planning_accuracy': 1 - abs(planned_total - actual_total) / planned_total if planned_total > 0 else 0,
             'total_focus_time': summary['actual_focus_time'],
             'task_count': len(data['planned_tasks']),
-            'completed_count': len([t for t in data['actual_execution'] if t.get('completed', True)])
+            'completed_count': sum(1 for t in data['actual_execution'] if t.get('completed', True))
         }
         return metrics
     
@@ -71,8 +100,11 @@ class StudyDataManager:
         """按学科统计"""
         subject_stats = {}
         for day_data in data:
+            # 当天 task_id → 学科 的映射，实际执行按字典查找，不再逐个扫描计划任务
+            task_subjects = {}
             for task in day_data['planned_tasks']:
                 subject = task['subject']
+                task_subjects.setdefault(task['task_id'], subject)
                 if subject not in subject_stats:
                     subject_stats[subject] = {'planned_time': 0, 'actual_time': 0, 'count': 0}
                 
@@ -80,8 +112,7 @@ class StudyDataManager:
                 subject_stats[subject]['count'] += 1
             
             for task in day_data['actual_execution']:
-                subject = next((t['subject'] for t in day_data['planned_tasks'] 
-                              if t['task_id'] == task['task_id']), '未知')
+                subject = task_subjects.get(task['task_id'], '未知')
                 if subject in subject_stats:
                     subject_stats[subject]['actual_time'] += task['actual_duration']
         
@@ -1,10 +1,37 @@
 # github_manager.py
 import base64
 import json
+import time
 from datetime import datetime
 import streamlit as st
 from github import Github, GithubException
-import pandas as pd
+
+try:
+    import orjson
+except ImportError:
+    # 未安装 orjson 时回退到标准库 json
+    orjson = None
+
+def dumps_json(data, indent=True):
+    """序列化为 JSON 字符串，优先使用 orjson；indent=False 时输出紧凑格式"""
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2 if indent else 0
+        return orjson.dumps(data, option=option).decode('utf-8')
+    if indent:
+        return json.dumps(data, ensure_ascii=False, indent=2)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+def dumps_sorted_bytes(data):
+    """序列化为键有序的紧凑 JSON 字节 - 用于计算状态哈希，结果只在本进程内比较"""
+    if orjson is not None:
+        return orjson.dumps(data, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, sort_keys=True, default=str, separators=(',', ':')).encode('utf-8')
+
+def loads_json(content):
+    """解析 JSON 字符串或字节，优先使用 orjson"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
 
 class GitHubDataManager:
     def __init__(self):
@@ -13,6 +40,11 @@ class GitHubDataManager:
         self.data_file = "study_data.json"
         self.gh = None
         self.repo = None
+        self._file_shas = {}  # 最近一次读取到的文件 SHA，保存时可省去一次查询
+        self._data_blob = (None, None)  # (sha, 解析后的数据)，SHA 未变时跳过解码
+        self._data_fetched_at = 0.0  # 上次从 GitHub 拉取数据的时间
+        self.data_version = 0  # 学习数据版本号（进程内共享），数据写入或远端内容变化时递增，供页面缓存作键
+        self.cache_ttl = 60  # 读取缓存有效期（秒），期间不再请求 GitHub
         self.setup_github()
     
     def setup_github(self):
@@ -37,16 +69,29 @@ class GitHubDataManager:
         """检查是否成功连接到 GitHub"""
         return self.gh is not None and self.repo is not None
     
-    def load_all_data(self):
-        """从 GitHub 加载所有数据"""
+    def load_all_data(self, force_refresh=False):
+        """从 GitHub 加载所有数据；缓存有效期内直接返回上次的结果，force_refresh=True 时强制重新拉取"""
         if not self.is_connected():
             return self._load_local_fallback()
         
+        cached_sha, cached_data = self._data_blob
+        if not force_refresh and cached_sha is not None and time.monotonic() - self._data_fetched_at < self.cache_ttl:
+            st.session_state.github_data_cache = cached_data
+            return cached_data
+        
         try:
             # 尝试从 GitHub 获取文件
             contents = self.repo.get_contents(self.data_file)
-            file_content = base64.b64decode(contents.content).decode('utf-8')
-            data = json.loads(file_content)
+            self._file_shas[self.data_file] = contents.sha
+            cached_sha, cached_data = self._data_blob
+            if contents.sha == cached_sha:
+                # 文件未变化，直接复用上次解析的结果
+                data = cached_data
+            else:
+                data = loads_json(base64.b64decode(contents.content))
+                self._data_blob = (contents.sha, data)
+                self.data_version += 1
+            self._data_fetched_at = time.monotonic()
             
             # 同时更新本地 session state 作为缓存
             st.session_state.github_data_cache = data
@@ -66,6 +111,14 @@ class GitHubDataManager:
             st.error(f"❌ 加载数据时出错: {e}")
             return self._load_local_fallback()
     
+    def invalidate_cache(self, filename: str):
+        """文件在本类之外被修改或删除后，丢弃该文件缓存的 SHA 和数据"""
+        self._file_shas.pop(filename, None)
+        if filename == self.data_file:
+            self._data_blob = (None, None)
+            self._data_fetched_at = 0.0
+            self.data_version += 1
+    
     def _load_local_fallback(self):
         """GitHub 不可用时使用本地回退"""
         return st.session_state.get('study_data', [])
@@ -73,13 +126,31 @@ class GitHubDataManager:
     def _save_to_github(self, data):
         """保存数据到 GitHub"""
         try:
-            content = json.dumps(data, ensure_ascii=False, indent=2)
+            content = dumps_json(data, indent=False)
+            self._data_blob = (None, None)
+            self.data_version += 1
+            
+            # 直接用最近一次读取或写入得到的 SHA 更新，省去一次 get_contents
+            sha = self._file_shas.pop(self.data_file, None)
+            if sha is not None:
+                try:
+                    result = self.repo.update_file(
+                        self.data_file,
+                        f"更新学习数据 {datetime.now().strftime('%Y-%m-%d %H:%M')}",
+                        content,
+                        sha
+                    )
+                    self._file_shas[self.data_file] = result['content'].sha
+                    return True
+                except GithubException:
+                    # SHA 已过期（文件在读取后被修改），回退到重新查询
+                    pass
             
             # 检查文件是否存在
             try:
                 contents = self.repo.get_contents(self.data_file)
                 # 文件存在，更新它
-                self.repo.update_file(
+                result = self.repo.update_file(
                     self.data_file,
                     f"更新学习数据 {datetime.now().strftime('%Y-%m-%d %H:%M')}",
                     content,
@@ -87,12 +158,14 @@ class GitHubDataManager:
                 )
             except GithubException:
                 # 文件不存在，创建新文件
-                self.repo.create_file(
+                result = self.repo.create_file(
                     self.data_file,
                     f"创建学习数据 {datetime.now().strftime('%Y-%m-%d %H:%M')}",
                     content
                 )
             
+            # 记下写入后的新 SHA，下次保存无需先查询
+            self._file_shas[self.data_file] = result['content'].sha
             return True
             
         except Exception as e:
@@ -100,20 +173,34 @@ class GitHubDataManager:
             return False
 
     # 新增方法：支持状态管理器保存原始内容
-    def save_raw_content(self, filename: str, content: str, commit_message: str = None):
-        """保存原始内容到指定文件"""
+    def save_raw_content(self, filename: str, content: str, commit_message: str = None, require_known_sha: bool = False):
+        """保存原始内容到指定文件；require_known_sha=True 时只用已知的 SHA 更新，SHA 缺失或已过期时直接返回 False"""
         if not self.is_connected():
             return False
             
         try:
             if commit_message is None:
                 commit_message = f"更新 {filename} {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+            
+            # 直接用最近一次读取或写入得到的 SHA 更新，省去一次 get_contents
+            sha = self._file_shas.pop(filename, None)
+            if sha is not None:
+                try:
+                    result = self.repo.update_file(filename, commit_message, content, sha)
+                    self._file_shas[filename] = result['content'].sha
+                    return True
+                except GithubException:
+                    # SHA 已过期（文件在读取后被修改），回退到重新查询
+                    pass
+            
+            if require_known_sha:
+                return False
                 
             # 检查文件是否存在
             try:
                 contents = self.repo.get_contents(filename)
                 # 文件存在，更新它
-                self.repo.update_file(
+                result = self.repo.update_file(
                     filename,
                     commit_message,
                     content,
@@ -121,12 +208,14 @@ class GitHubDataManager:
                 )
             except GithubException:
                 # 文件不存在，创建新文件
-                self.repo.create_file(
+                result = self.repo.create_file(
                     filename,
                     commit_message,
                     content
                 )
             
+            # 记下写入后的新 SHA，连续保存时无需再次查询
+            self._file_shas[filename] = result['content'].sha
             return True
             
         except Exception as e:
@@ -141,6 +230,7 @@ class GitHubDataManager:
             
         try:
             contents = self.repo.get_contents(filename)
+            self._file_shas[filename] = contents.sha
             file_content = base64.b64decode(contents.content).decode('utf-8')
             return file_content
         except GithubException as e:
@@ -172,10 +262,11 @@ class GitHubDataManager:
     def add_daily_record(self, date, weather, energy_level, planned_tasks, actual_execution, daily_summary):
         """添加每日记录到 GitHub"""
         try:
-            # 加载现有数据
-            all_data = self.load_all_data()
+            # 加载现有数据（写入前强制拉取最新内容，避免覆盖其他会话的修改）
+            all_data = self.load_all_data(force_refresh=True)
             
-            # 创建新记录
+            # 创建新记录（创建、更新与同步时间取同一时刻）
+            now_iso = datetime.now().isoformat()
             new_record = {
                 "date": date,
                 "weather": weather,
@@ -183,18 +274,24 @@ class GitHubDataManager:
                 "planned_tasks": planned_tasks,
                 "actual_execution": actual_execution,
                 "daily_summary": daily_summary,
-                "created_at": datetime.now().isoformat(),
-                "updated_at": datetime.now().isoformat()
+                "created_at": now_iso,
+                "updated_at": now_iso
             }
             
-            # 移除同一天的旧记录（如果存在）
-            all_data = [record for record in all_data if record['date'] != date]
+            # 移除同一天的旧记录（如果存在），同时找到新记录的插入位置
+            # （文件中的记录始终按日期倒序保存，插入后无需重新排序）
+            remaining = []
+            insert_at = None
+            for record in all_data:
+                if record['date'] == date:
+                    continue
+                if insert_at is None and record['date'] < date:
+                    insert_at = len(remaining)
+                remaining.append(record)
             
             # 添加新记录
-            all_data.append(new_record)
-            
-            # 按日期排序
-            all_data.sort(key=lambda x: x['date'], reverse=True)
+            remaining.insert(len(remaining) if insert_at is None else insert_at, new_record)
+            all_data = remaining
             
             # 保存到 GitHub
             success = self._save_to_github(all_data)
@@ -205,7 +302,7 @@ class GitHubDataManager:
                 st.session_state.study_data = all_data
                 
                 # 记录同步状态
-                st.session_state.last_sync = datetime.now().isoformat()
+                st.session_state.last_sync = now_iso
                 
             return success
             
@@ -224,10 +321,10 @@ class GitHubDataManager:
     def calculate_daily_metrics(self, day_data):
         """计算每日指标（与原有方法兼容）"""
         try:
-            planned_total = day_data['daily_summary'].get('planned_total_time', 0)
-            actual_total = day_data['daily_summary'].get('actual_total_time', 0)
-            planned_focus = day_data['daily_summary'].get('planned_focus_time', 0)
-            actual_focus = day_data['daily_summary'].get('actual_focus_time', 0)
+            summary = day_data['daily_summary']
+            planned_total = summary.get('planned_total_time', 0)
+            actual_total = summary.get('actual_total_time', 0)
+            actual_focus = summary.get('actual_focus_time', 0)
             
             completion_rate = actual_total / planned_total if planned_total > 0 else 0
             focus_efficiency = actual_focus / actual_total if actual_total > 0 else 0
@@ -255,6 +352,11 @@ class GitHubDataManager:
         subject_stats = {}
         
         for day in data:
+            # 当天 task_id → 实际执行记录 的映射，每个计划任务按字典查找
+            actual_by_id = {}
+            for t in day.get('actual_execution', []):
+                actual_by_id.setdefault(t.get('task_id'), t)
+            
             for task in day.get('planned_tasks', []):
                 subject = task.get('subject', 'other')
                 if subject not in subject_stats:
@@ -267,11 +369,7 @@ class GitHubDataManager:
                 subject_stats[subject]['planned_time'] += task.get('planned_duration', 0)
                 
                 # 实际时间
-                task_id = task.get('task_id')
-                actual_task = next(
-                    (t for t in day.get('actual_execution', []) if t.get('task_id') == task_id),
-                    None
-                )
+                actual_task = actual_by_id.get(task.get('task_id'))
                 if actual_task:
                     subject_stats[subject]['actual_time'] += actual_task.get('actual_duration', 0)
         
@@ -289,7 +387,7 @@ class GitHubDataManager:
     def force_sync(self):
         """强制同步数据"""
         try:
-            data = self.load_all_data()
+            data = self.load_all_data(force_refresh=True)
             success = self._save_to_github(data)
             if success:
                 st.session_state.last_sync = datetime.now().isoformat()
@@ -1,23 +1,76 @@
 import streamlit as st
-import json
 from datetime import datetime, time, timedelta
-from github_manager import GitHubDataManager
+from functools import lru_cache
+from github_manager import GitHubDataManager, dumps_json, dumps_sorted_bytes, loads_json
 import pytz
 import hashlib
 
 # 北京时区
 beijing_tz = pytz.timezone('Asia/Shanghai')
 
+def now_beijing():
+    """当前北京时间"""
+    return datetime.now(beijing_tz)
+
+def _times_to_hhmm(record, keys):
+    """复制一条记录，并把指定字段中的 time 对象转为 HH:MM 字符串"""
+    converted = record.copy()
+    for key in keys:
+        value = converted.get(key)
+        if isinstance(value, time):
+            converted[key] = f"{value.hour:02d}:{value.minute:02d}"
+    return converted
+
+@lru_cache(maxsize=256)
+def _parse_hm(time_str):
+    """把 'HH:MM' 或 'HH:MM:SS' 解析为 time（只取时、分），格式不对时抛出 ValueError"""
+    hour, minute = time_str.split(':')[:2]
+    if not (0 < len(hour) <= 2 and hour.isdigit() and 0 < len(minute) <= 2 and minute.isdigit()):
+        raise ValueError(f"无效的时间: {time_str}")
+    return time(int(hour), int(minute))
+
+def _restore_times(record, fields):
+    """复制一条记录，并把指定字段中的时间字符串解析为 time 对象；无法解析时使用对应的默认值"""
+    restored = record.copy()
+    for key, default in fields:
+        value = restored.get(key)
+        if isinstance(value, str) and ':' in value:
+            try:
+                restored[key] = _parse_hm(value)
+            except ValueError:
+                restored[key] = default
+    return restored
+
+def _maybe_notify(level, message):
+    """侧边栏提示 - 与本次运行中上一条提示相同时不再重复显示（记录由 app.py 在每次运行开始时清空）"""
+    if st.session_state.get('_last_notify') == (level, message):
+        return
+    st.session_state['_last_notify'] = (level, message)
+    getattr(st.sidebar, level)(message)
+
 class GitHubStateManager:
     """使用 GitHub 作为持久化存储的状态管理器 - 以计划日期为主键"""
     
+    # 恢复状态时直接按键取值的字段及其默认值
+    _RESTORE_DEFAULTS = (
+        ('tasks_confirmed', False),
+        ('show_final_confirmation', False),
+        ('tasks_saved', False),
+        ('expander_expanded', True),
+        ('current_weather', "晴"),
+        ('current_energy_level', 7),
+        ('current_reflection', ""),
+        ('plan_source', 'loaded'),
+    )
+    
     def __init__(self):
         self.github_manager = GitHubDataManager()
         self.state_key = "daily_session_state.json"
         self.initialized = False
-        self.last_save_time = None
         self.min_save_interval = timedelta(seconds=30)
-        self.last_state_hash = None
+        # 上次保存时间 last_save_time、上次保存的状态哈希 last_state_hash、
+        # 是否有被频率控制推迟的修改 save_pending 都描述单个会话，保存在 st.session_state 中
+        self._saved_states = None  # 最近一次由自动保存写入 GitHub 的全部状态，连续保存时免去重新读取
     
     def init_session_state(self):
         """初始化 session state - 以当前计划日期为主键"""
@@ -25,7 +78,7 @@ class GitHubStateManager:
             return
             
         # 获取当前选择的计划日期
-        current_plan_date = st.session_state.get('current_date', datetime.now(beijing_tz).date())
+        current_plan_date = st.session_state.get('current_date', now_beijing().date())
         plan_date_iso = current_plan_date.isoformat()
         
         # 尝试加载当前计划日期的状态
@@ -40,7 +93,7 @@ class GitHubStateManager:
     def _initialize_new_plan(self, plan_date_iso: str):
         """为新的计划日期初始化状态"""
         plan_date = datetime.fromisoformat(plan_date_iso).date()
-        today = datetime.now(beijing_tz).date()
+        today = now_beijing().date()
         
         default_states = {
             'tasks_confirmed': False,
@@ -57,8 +110,8 @@ class GitHubStateManager:
             'last_auto_save': None,
             'plan_date': plan_date_iso,  # 主键：计划日期
             'plan_source': "new",
-            'created_at': datetime.now(beijing_tz).isoformat(),
-            'last_modified': datetime.now(beijing_tz).isoformat()
+            'created_at': now_beijing().isoformat(),
+            'last_modified': now_beijing().isoformat()
         }
         
         for key, value in default_states.items():
@@ -79,29 +132,23 @@ class GitHubStateManager:
             if not force and self._is_empty_state():
                 return False
                 
-            # 频率控制
-            current_time = datetime.now(beijing_tz)
-            if (self.last_save_time and 
-                current_time - self.last_save_time < self.min_save_interval and 
-                not force):
-                return False
-            
-            # 智能变化检测
+            # 智能变化检测：状态与上次保存一致时跳过 GitHub 写入
             current_state_hash = self._get_state_hash()
+            last_state_hash = st.session_state.get('last_state_hash')
+            if (not force and 
+                last_state_hash and 
+                current_state_hash == last_state_hash):
+                st.session_state.save_pending = False
+                return False
             
-            # 如果有实际执行数据，降低保存门槛
-            actual_execution = st.session_state.get('actual_execution', [])
-            has_actual_data = actual_execution and len(actual_execution) > 0
-            
-            if has_actual_data:
-                # 执行阶段：频繁保存
-                pass
-            else:
-                # 计划阶段：严格检查变化
-                if (not force and 
-                    self.last_state_hash and 
-                    current_state_hash == self.last_state_hash):
-                    return False
+            # 频率控制：间隔内的修改先留在本地，标记为待写入
+            current_time = now_beijing()
+            last_save_time = st.session_state.get('last_save_time')
+            if (last_save_time and 
+                current_time - last_save_time < self.min_save_interval and 
+                not force):
+                st.session_state.save_pending = True
+                return False
 
             # 确保状态正确性
             self._ensure_state_consistency()
@@ -125,24 +172,27 @@ class GitHubStateManager:
             if success:
                 st.session_state.last_auto_save = current_time
                 st.session_state.last_modified = current_time.isoformat()
-                self.last_save_time = current_time
-                self.last_state_hash = current_state_hash
+                st.session_state.last_save_time = current_time
+                st.session_state.last_state_hash = current_state_hash
+                st.session_state.save_pending = False
                 
                 # 只在强制保存时显示提示，避免干扰
                 if force:
-                    today = datetime.now(beijing_tz).date()
+                    today = now_beijing().date()
                     if plan_date == today:
-                        st.sidebar.success("💾 今日计划已保存")
+                        _maybe_notify('success', "💾 今日计划已保存")
                     elif plan_date > today:
-                        st.sidebar.success(f"💾 {plan_date} 未来计划已保存")
+                        _maybe_notify('success', f"💾 {plan_date} 未来计划已保存")
                     else:
-                        st.sidebar.success(f"💾 {plan_date} 记录已保存")
+                        _maybe_notify('success', f"💾 {plan_date} 记录已保存")
                     
                 return True
             
             return False
                     
         except Exception as e:
+            # 出错提示每次都显示，并重置去重记录，恢复后的保存提示照常出现
+            st.session_state.pop('_last_notify', None)
             st.sidebar.error(f"❌ 保存失败: {str(e)}")
             return False
     
@@ -228,7 +278,7 @@ class GitHubStateManager:
     def get_state_info(self):
         """获取状态信息 - 基于计划日期"""
         plan_date = st.session_state.get('current_date')
-        today = datetime.now(beijing_tz).date()
+        today = now_beijing().date()
         
         if plan_date:
             is_today = plan_date == today
@@ -306,32 +356,22 @@ class GitHubStateManager:
             else:
                 serializable_time_cache[key] = value
         
-        # 处理 planned_tasks 中的时间对象
-        serializable_planned_tasks = []
-        planned_tasks = st.session_state.get('planned_tasks', [])
-        
-        for task in planned_tasks:
-            serializable_task = task.copy()
-            if 'planned_start_time' in serializable_task and isinstance(serializable_task['planned_start_time'], time):
-                serializable_task['planned_start_time'] = serializable_task['planned_start_time'].strftime('%H:%M')
-            if 'planned_end_time' in serializable_task and isinstance(serializable_task['planned_end_time'], time):
-                serializable_task['planned_end_time'] = serializable_task['planned_end_time'].strftime('%H:%M')
-            serializable_planned_tasks.append(serializable_task)
-        
-        # 处理 actual_execution 中的时间对象
-        serializable_actual_execution = []
-        actual_execution = st.session_state.get('actual_execution', [])
+        # 处理 planned_tasks / actual_execution 中的时间对象
+        serializable_planned_tasks = [
+            _times_to_hhmm(task, ('planned_start_time', 'planned_end_time'))
+            for task in st.session_state.get('planned_tasks', [])
+        ]
+        serializable_actual_execution = [
+            _times_to_hhmm(execution, ('actual_start_time', 'actual_end_time'))
+            for execution in st.session_state.get('actual_execution', [])
+        ]
         
-        for execution in actual_execution:
-            serializable_execution = execution.copy()
-            if 'actual_start_time' in serializable_execution and isinstance(serializable_execution['actual_start_time'], time):
-                serializable_execution['actual_start_time'] = serializable_execution['actual_start_time'].strftime('%H:%M')
-            if 'actual_end_time' in serializable_execution and isinstance(serializable_execution['actual_end_time'], time):
-                serializable_execution['actual_end_time'] = serializable_execution['actual_end_time'].strftime('%H:%M')
-            serializable_actual_execution.append(serializable_execution)
+        # 本次保存的各个时间戳取同一时刻
+        now = now_beijing()
+        now_iso = now.isoformat()
         
         plan_date = st.session_state.get('current_date')
-        plan_date_iso = plan_date.isoformat() if plan_date else datetime.now(beijing_tz).date().isoformat()
+        plan_date_iso = plan_date.isoformat() if plan_date else now.date().isoformat()
         
         return {
             'tasks_confirmed': st.session_state.get('tasks_confirmed', False),
@@ -345,18 +385,25 @@ class GitHubStateManager:
             'planned_tasks': serializable_planned_tasks,
             'actual_execution': serializable_actual_execution,
             'time_inputs_cache': serializable_time_cache,
-            'last_auto_save': datetime.now(beijing_tz).isoformat(),
+            'last_auto_save': now_iso,
             'plan_date': plan_date_iso,  # 主键：计划日期
             'plan_source': st.session_state.get('plan_source', 'new'),
-            'created_at': st.session_state.get('created_at', datetime.now(beijing_tz).isoformat()),
-            'last_modified': datetime.now(beijing_tz).isoformat(),
-            'saved_at': datetime.now(beijing_tz).isoformat()
+            'created_at': st.session_state.get('created_at', now_iso),
+            'last_modified': now_iso,
+            'saved_at': now_iso
         }
 
     def manual_save_state(self):
         """手动保存状态"""
         return self.auto_save_state(force=True)
 
+    def flush_pending_save(self):
+        """确保最新状态已写入 GitHub - 用于提交等关键操作"""
+        if (st.session_state.get('save_pending', False) or
+                self._get_state_hash() != st.session_state.get('last_state_hash')):
+            return self.auto_save_state(force=True)
+        return True
+
     def _get_state_hash(self):
         """生成状态哈希值"""
         state_data = {
@@ -401,8 +448,8 @@ class GitHubStateManager:
             processed_actual_execution.append(processed_execution)
         state_data['actual_execution'] = processed_actual_execution
         
-        state_str = json.dumps(state_data, sort_keys=True, default=str)
-        return hashlib.md5(state_str.encode()).hexdigest()
+        # 哈希只用于变化检测，不做持久化，用更快的 blake2b 即可
+        return hashlib.blake2b(dumps_sorted_bytes(state_data), digest_size=16).hexdigest()
 
     def load_from_github(self, plan_date_key):
         """从 GitHub 加载指定计划日期的状态"""
@@ -428,83 +475,32 @@ class GitHubStateManager:
             return False
             
         try:
-            # 恢复基础状态
-            st.session_state.tasks_confirmed = data.get('tasks_confirmed', False)
-            st.session_state.show_final_confirmation = data.get('show_final_confirmation', False)
-            st.session_state.tasks_saved = data.get('tasks_saved', False)
-            st.session_state.expander_expanded = data.get('expander_expanded', True)
+            # 恢复基础状态、天气/精力/反思和计划来源
+            session_state = st.session_state
+            for key, default in self._RESTORE_DEFAULTS:
+                session_state[key] = data.get(key, default)
             
             # 恢复计划日期
             if 'current_date' in data:
                 st.session_state.current_date = datetime.fromisoformat(data['current_date']).date()
                 st.session_state.plan_date = data['current_date']  # 设置主键
             
-            st.session_state.current_weather = data.get('current_weather', "晴")
-            st.session_state.current_energy_level = data.get('current_energy_level', 7)
-            st.session_state.current_reflection = data.get('current_reflection', "")
-            
-            # 恢复计划来源
-            st.session_state.plan_source = data.get('plan_source', 'loaded')
-            
             # 恢复创建和修改时间
-            st.session_state.created_at = data.get('created_at', datetime.now(beijing_tz).isoformat())
-            st.session_state.last_modified = data.get('last_modified', datetime.now(beijing_tz).isoformat())
+            now_iso = now_beijing().isoformat()
+            st.session_state.created_at = data.get('created_at', now_iso)
+            st.session_state.last_modified = data.get('last_modified', now_iso)
             
             # 恢复任务数据（处理时间字符串）
-            planned_tasks = data.get('planned_tasks', [])
-            restored_planned_tasks = []
-            for task in planned_tasks:
-                restored_task = task.copy()
-                # 转换时间字符串为 time 对象
-                if 'planned_start_time' in restored_task and isinstance(restored_task['planned_start_time'], str):
-                    try:
-                        time_str = restored_task['planned_start_time']
-                        if ':' in time_str:
-                            parts = time_str.split(':')
-                            if len(parts) >= 2:
-                                restored_task['planned_start_time'] = datetime.strptime(f"{parts[0]}:{parts[1]}", '%H:%M').time()
-                    except ValueError:
-                        restored_task['planned_start_time'] = datetime.strptime("09:00", '%H:%M').time()
-                if 'planned_end_time' in restored_task and isinstance(restored_task['planned_end_time'], str):
-                    try:
-                        time_str = restored_task['planned_end_time']
-                        if ':' in time_str:
-                            parts = time_str.split(':')
-                            if len(parts) >= 2:
-                                restored_task['planned_end_time'] = datetime.strptime(f"{parts[0]}:{parts[1]}", '%H:%M').time()
-                    except ValueError:
-                        restored_task['planned_end_time'] = datetime.strptime("10:00", '%H:%M').time()
-                restored_planned_tasks.append(restored_task)
-            
-            st.session_state.planned_tasks = restored_planned_tasks
+            st.session_state.planned_tasks = [
+                _restore_times(task, (('planned_start_time', time(9, 0)), ('planned_end_time', time(10, 0))))
+                for task in data.get('planned_tasks', [])
+            ]
             
             # 恢复实际执行数据（处理时间字符串）
-            actual_execution = data.get('actual_execution', [])
-            restored_actual_execution = []
-            for execution in actual_execution:
-                restored_execution = execution.copy()
-                # 转换时间字符串为 time 对象
-                if 'actual_start_time' in restored_execution and isinstance(restored_execution['actual_start_time'], str):
-                    try:
-                        time_str = restored_execution['actual_start_time']
-                        if ':' in time_str:
-                            parts = time_str.split(':')
-                            if len(parts) >= 2:
-                                restored_execution['actual_start_time'] = datetime.strptime(f"{parts[0]}:{parts[1]}", '%H:%M').time()
-                    except ValueError:
-                        restored_execution['actual_start_time'] = datetime.strptime("09:00", '%H:%M').time()
-                if 'actual_end_time' in restored_execution and isinstance(restored_execution['actual_end_time'], str):
-                    try:
-                        time_str = restored_execution['actual_end_time']
-                        if ':' in time_str:
-                            parts = time_str.split(':')
-                            if len(parts) >= 2:
-                                restored_execution['actual_end_time'] = datetime.strptime(f"{parts[0]}:{parts[1]}", '%H:%M').time()
-                    except ValueError:
-                        restored_execution['actual_end_time'] = datetime.strptime("10:00", '%H:%M').time()
-                restored_actual_execution.append(restored_execution)
-            
-            st.session_state.actual_execution = restored_actual_execution
+            st.session_state.actual_execution = [
+                _restore_times(execution, (('actual_start_time', time(9, 0)), ('actual_end_time', time(10, 0))))
+                for execution in data.get('actual_execution', [])
+            ]
             
             # 恢复时间缓存（处理时间字符串）
             time_inputs_cache = data.get('time_inputs_cache', {})
@@ -512,9 +508,7 @@ class GitHubStateManager:
             for key, value in time_inputs_cache.items():
                 if isinstance(value, str) and ':' in value:
                     try:
-                        parts = value.split(':')
-                        if len(parts) >= 2:
-                            restored_time_cache[key] = datetime.strptime(f"{parts[0]}:{parts[1]}", '%H:%M').time()
+                        restored_time_cache[key] = _parse_hm(value)
                     except ValueError:
                         restored_time_cache[key] = value
                 else:
@@ -536,12 +530,27 @@ class GitHubStateManager:
             return False
             
         try:
+            # 在上次写入的内容上直接更新，只有远端 SHA 未变时才会写入成功
+            all_states = self._saved_states
+            if all_states is not None:
+                all_states[plan_date_key] = data
+                self._cleanup_old_states(all_states)
+                
+                content = dumps_json(all_states, indent=False)
+                if self._save_raw_to_github(content, require_known_sha=True):
+                    self._saved_states = all_states
+                    return True
+            
+            # 没有缓存或文件已被其他会话修改：重新读取后合并
             all_states = self._load_all_states_from_github()
             all_states[plan_date_key] = data
             self._cleanup_old_states(all_states)
             
-            content = json.dumps(all_states, ensure_ascii=False, indent=2)
-            return self._save_raw_to_github(content)
+            content = dumps_json(all_states, indent=False)
+            success = self._save_raw_to_github(content)
+            if success:
+                self._saved_states = all_states
+            return success
             
         except Exception as e:
             return False
@@ -550,46 +559,54 @@ class GitHubStateManager:
         """从 GitHub 加载所有状态数据"""
         if not self.github_manager.is_connected():
             return {}
-            
+
+        # 读取会把缓存的 SHA 换成远端最新的 SHA，上次写入的状态与之不再对应，必须作废
+        self._saved_states = None
         try:
             file_content = self.github_manager.load_raw_content(self.state_key)
             if file_content:
-                return json.loads(file_content)
+                return loads_json(file_content)
             return {}
         except Exception as e:
             return {}
 
-    def _save_raw_to_github(self, content):
+    def _save_raw_to_github(self, content, require_known_sha=False):
         """原始保存到 GitHub"""
+        # 任何写入之后缓存的状态都不再可信，由自动保存在成功后重新设置
+        self._saved_states = None
         try:
             return self.github_manager.save_raw_content(
                 self.state_key,
                 content,
-                f"更新会话状态 {datetime.now(beijing_tz).strftime('%Y-%m-%d %H:%M')}"
+                f"更新会话状态 {now_beijing().strftime('%Y-%m-%d %H:%M')}",
+                require_known_sha=require_known_sha
             )
         except Exception:
             return False
 
     def _cleanup_old_states(self, all_states):
-        """清理旧的状态数据（保留最近30天）"""
+        """清理旧的状态数据（保留最近30天）- 直接在传入的字典上删除过期项"""
         try:
-            today = datetime.now(beijing_tz).date()
+            today = now_beijing().date()
             cutoff_date = today - timedelta(days=30)
             
-            states_to_keep = {}
-            for date_key, data in all_states.items():
+            expired_keys = []
+            for date_key in all_states:
                 try:
                     state_date = datetime.fromisoformat(date_key).date()
-                    if state_date >= cutoff_date:
-                        states_to_keep[date_key] = data
+                    if state_date < cutoff_date:
+                        expired_keys.append(date_key)
                 except ValueError:
                     # 如果日期格式无效，保留该状态
-                    states_to_keep[date_key] = data
+                    pass
             
-            return states_to_keep
+            for date_key in expired_keys:
+                del all_states[date_key]
             
         except Exception:
-            return all_states
+            pass
+        
+        return all_states
 
     def clear_current_state(self):
         """清除当前计划日期的状态"""
@@ -623,8 +640,8 @@ class GitHubStateManager:
         st.session_state.time_inputs_cache = {}
         st.session_state.plan_date = plan_date_iso
         st.session_state.plan_source = "cleared"
-        st.session_state.created_at = datetime.now(beijing_tz).isoformat()
-        st.session_state.last_modified = datetime.now(beijing_tz).isoformat()
+        st.session_state.created_at = now_beijing().isoformat()
+        st.session_state.last_modified = now_beijing().isoformat()
         
         # 从 GitHub 删除该计划日期的状态
         if self.github_manager.is_connected():
@@ -632,7 +649,7 @@ class GitHubStateManager:
                 all_states = self._load_all_states_from_github()
                 if plan_date_iso in all_states:
                     del all_states[plan_date_iso]
-                    content = json.dumps(all_states, ensure_ascii=False, indent=2)
+                    content = dumps_json(all_states, indent=False)
                     self._save_raw_to_github(content)
             except Exception:
                 pass
@@ -662,7 +679,7 @@ class GitHubStateManager:
             all_states = self._load_all_states_from_github()
             stats['state_count'] = len(all_states)
             
-            cutoff_date = datetime.now(beijing_tz) - timedelta(days=30)
+            cutoff_date = now_beijing() - timedelta(days=30)
             stats['old_states'] = sum(
                 1 for date in all_states.keys() 
                 if datetime.fromisoformat(date).date() < cutoff_date.date()
@@ -718,7 +735,7 @@ class GitHubStateManager:
     def _cleanup_old_data(self, days_to_keep):
         """清理指定天数前的数据"""
         try:
-            cutoff_date = datetime.now(beijing_tz) - timedelta(days=days_to_keep)
+            cutoff_date = now_beijing() - timedelta(days=days_to_keep)
             deleted_count = 0
             
             # 清理状态数据
@@ -732,7 +749,7 @@ class GitHubStateManager:
                 }
                 
                 if len(all_states) < original_count:
-                    content = json.dumps(all_states, ensure_ascii=False, indent=2)
+                    content = dumps_json(all_states, indent=False)
                     self._save_raw_to_github(content)
                     deleted_count += (original_count - len(all_states))
             except Exception:
@@ -740,7 +757,8 @@ class GitHubStateManager:
             
             # 清理学习数据
             try:
-                all_study_data = self.github_manager.load_all_data()
+                # 读-改-写：强制拉取最新内容，避免用缓存中的旧数据覆盖远端
+                all_study_data = self.github_manager.load_all_data(force_refresh=True)
                 original_study_count = len(all_study_data)
                 
                 all_study_data = [
@@ -749,7 +767,6 @@ class GitHubStateManager:
                 ]
                 
                 if len(all_study_data) < original_study_count:
-                    content = json.dumps(all_study_data, ensure_ascii=False, indent=2)
                     self.github_manager._save_to_github(all_study_data)
                     deleted_count += (original_study_count - len(all_study_data))
             except Exception:
@@ -779,6 +796,8 @@ class GitHubStateManager:
                 )
             except Exception:
                 pass
+            self._saved_states = None
+            self.github_manager.invalidate_cache(self.state_key)
             
             # 清除学习数据
             try:
@@ -790,6 +809,7 @@ class GitHubStateManager:
                 )
             except Exception:
                 pass
+            self.github_manager.invalidate_cache(self.github_manager.data_file)
             
             self._clear_all_session_state()
             